@@ -1,18 +1,96 @@
+import math
+import os
 import random
+import threading
+from array import array
+from itertools import compress
 from sqlite3 import IntegrityError
 
+from account_cache import AccountCache
+from card_index import CardIndex
+from locks import StripedLock
+from luhn import Luhn
+from metrics import instrumented
+from pins import PinHasher
 from utils import singleton
 
-random.seed(43)
+BANK_IDENTIFICATION_NUMBER = '400000'
+ACCOUNT_IDENTIFIERS = 10 ** 9
+
+
+def _generate_range_accounts(start, size, count, seed):
+    rng = random.Random(seed)
+
+    # a multiplier coprime to the range size makes i -> (a * i + b) % size a permutation
+    multiplier = rng.randrange(1, size)
+    while math.gcd(multiplier, size) != 1:
+        multiplier = rng.randrange(1, size)
+    offset = rng.randrange(size)
+
+    payloads = [f'{BANK_IDENTIFICATION_NUMBER}{start + (multiplier * i + offset) % size:09}'
+                for i in range(count)]
+    checksums = Luhn.checksum_many(payloads)
+    return [(f'{payload}{checksum}', f'{rng.randint(0, 9999):04}', 0)
+            for payload, checksum in zip(payloads, checksums)]
 
 
 class Account:
+    __slots__ = ('card_id', 'pin', 'balance')
+
     def __init__(self, card_id, pin, balance):
         self.card_id = card_id
         self.pin = pin
         self.balance = balance
 
 
+class AccountTable:
+    def __init__(self, ids=(), card_ids=(), balances=()):
+        self.ids = array('q', ids)
+        self.card_ids = array('q', card_ids)
+        self.balances = array('q', balances)
+
+    @classmethod
+    def from_rows(cls, rows):
+        table = cls()
+        for row in rows:
+            table.append(*row)
+        return table
+
+    def append(self, account_id, number, pin, balance):
+        self.ids.append(account_id)
+        self.card_ids.append(int(number))
+        self.balances.append(balance)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        return Account(str(self.card_ids[index]), None, self.balances[index])
+
+    def __iter__(self):
+        for card_id, balance in zip(self.card_ids, self.balances):
+            yield Account(str(card_id), None, balance)
+
+    @property
+    def nbytes(self):
+        return sum(column.itemsize * len(column)
+                   for column in (self.ids, self.card_ids, self.balances))
+
+    def total_balance(self):
+        return sum(self.balances)
+
+    def select(self, mask):
+        mask = list(mask)
+        return AccountTable(compress(self.ids, mask),
+                            compress(self.card_ids, mask),
+                            compress(self.balances, mask))
+
+    def where_balance(self, minimum=None, maximum=None):
+        low = float('-inf') if minimum is None else minimum
+        high = float('inf') if maximum is None else maximum
+        return self.select(low <= balance <= high for balance in self.balances)
+
+
 @singleton
 class AccountGenerator:
     def generate_account(self):
@@ -21,30 +99,31 @@ class AccountGenerator:
         balance = 0
         return card_id, pin, balance
 
-    def _generate_card_id(self):
-        bank_identification_number = '400000'
-        account_identifier = str(random.randint(0, 999999999)).zfill(9)
-        checksum = self._generate_checksum(
-            bank_identification_number, account_identifier)
-        return f'{bank_identification_number}{account_identifier}{checksum}'
+    def generate_accounts(self, n, workers=None):
+        if not workers:
+            return [self.generate_account() for _ in range(n)]
 
-    def _generate_checksum(self, bank_identification_number, account_identifier):
-        digits = bank_identification_number + account_identifier
-        digits_list = self._transform_digits(digits)
-        return self._select_checksum(digits_list)
+        range_size = ACCOUNT_IDENTIFIERS // workers
+        per_worker = math.ceil(n / workers)
+        if per_worker > range_size:
+            raise ValueError(f'Cannot generate {n} unique card numbers')
 
-    @staticmethod
-    def _transform_digits(digits):
-        # multiple odd number by 2
-        digits_list = [int(digit) * 2 if i % 2 == 0 else int(digit)
-                       for i, digit in enumerate(digits)]
+        from concurrent.futures import ProcessPoolExecutor
 
-        # subtract 9 from digits greater than 9
-        return [digit - 9 if digit > 9 else digit for digit in digits_list]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunks = executor.map(
+                _generate_range_accounts,
+                [worker * range_size for worker in range(workers)],
+                [range_size] * workers,
+                [per_worker] * workers,
+                [int.from_bytes(os.urandom(8), 'big') for _ in range(workers)])
+            accounts = [account for chunk in chunks for account in chunk]
+        return accounts[:n]
 
-    @staticmethod
-    def _select_checksum(digits_list):
-        return (10 - sum(digits_list) % 10) % 10
+    def _generate_card_id(self):
+        account_identifier = str(random.randint(0, ACCOUNT_IDENTIFIERS - 1)).zfill(9)
+        checksum = Luhn.checksum(BANK_IDENTIFICATION_NUMBER + account_identifier)
+        return f'{BANK_IDENTIFICATION_NUMBER}{account_identifier}{checksum}'
 
     @staticmethod
     def _generate_pin():
@@ -52,30 +131,125 @@ class AccountGenerator:
 
 
 @singleton
+@instrumented('add_account', 'add_accounts', 'get_account', 'get_balance', 'add_income',
+              'transfer', 'close_account', 'load_table', 'check_account')
 class AccountSupervisor:
-    def __init__(self, database):
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, database, cache_size=10000, pin_cost=10000, lock_stripes=1024,
+                 cache_ttl=30.0):
         self.database = database
         self.account_generator = AccountGenerator()
+        self._card_index = None
+        self.card_index_lock = threading.Lock()
+        self.cache = AccountCache(cache_size, cache_ttl)
+        self.pin_hasher = PinHasher(pin_cost)
+        self.card_locks = StripedLock(lock_stripes)
+
+    @property
+    def card_index(self):
+        if self._card_index is None:
+            with self.card_index_lock:
+                if self._card_index is None:
+                    self._card_index = CardIndex(self.database.get_numbers())
+        return self._card_index
 
     def add_account(self):
-        account_properties = self.account_generator.generate_account()
-        card_id, pin, balance = account_properties
-
-        try:
-            self.database.add_account(card_id, pin, balance)
-            return Account(*account_properties)
-        except IntegrityError:
-            return self.add_account()
+        for _ in range(self.MAX_ATTEMPTS):
+            account_properties = self.account_generator.generate_account()
+            card_id, pin, balance = account_properties
+            # the UNIQUE constraint catches collisions; loading the index for one card is not worth it
+            if self._card_index is not None and card_id in self._card_index:
+                continue
+            try:
+                self.database.add_account(card_id, self.pin_hasher.hash(pin), balance)
+                if self._card_index is not None:
+                    self._card_index.add(card_id)
+                return Account(*account_properties)
+            except IntegrityError:
+                continue
+        raise IntegrityError(
+            f'Could not generate a unique card number in {self.MAX_ATTEMPTS} attempts')
+
+    def add_accounts(self, n, workers=None):
+        accounts = {}
+        for _ in range(self.MAX_ATTEMPTS):
+            missing = n - len(accounts)
+            if not missing:
+                break
+            for account_properties in self.account_generator.generate_accounts(missing, workers):
+                card_id = account_properties[0]
+                if card_id not in self.card_index and card_id not in accounts:
+                    accounts[card_id] = account_properties
+
+        if len(accounts) < n:
+            raise IntegrityError(
+                f'Could not generate {n} unique card numbers in {self.MAX_ATTEMPTS} rounds')
+
+        pin_hashes = self.pin_hasher.hash_many(
+            [pin for _, pin, _ in accounts.values()], workers)
+        self.database.add_accounts([(card_id, pin_hash, balance)
+                                    for (card_id, _, balance), pin_hash
+                                    in zip(accounts.values(), pin_hashes)])
+        self.card_index.add_many(accounts)
+        return [Account(*account_properties) for account_properties in accounts.values()]
+
+    def _find_account(self, card_id):
+        account = self.cache.get(card_id)
+        if account:
+            return account
+
+        generation = self.cache.generation
+        account_properties = self.database.find_account(card_id)
+        if not account_properties:
+            return None
+
+        account = Account(*account_properties)
+        self.cache.put(account, generation)
+        return account
 
     def get_account(self, card_id, pin):
-        account_properties = self.database.get_account(card_id, pin)
-        return Account(*account_properties) if account_properties else None
+        account = self._find_account(card_id)
+        if not account or not self.pin_hasher.verify(pin, account.pin):
+            return None
+
+        if self.pin_hasher.is_legacy(account.pin):
+            self.database.set_pin(card_id, self.pin_hasher.hash(pin))
+            self.cache.invalidate(card_id)
+        return account
+
+    def get_balance(self, card_id):
+        # writes here invalidate the entry; the cache TTL bounds how long other processes' writes go unseen
+        account = self._find_account(card_id)
+        return account.balance if account else None
 
     def add_income(self, card_id, income):
-        self.database.add_income(card_id, income)
+        # the UPDATE is atomic on its own; holding a stripe here would serialize group commits
+        credited = self.database.add_income(card_id, income)
+        self.cache.invalidate(card_id)
+        return credited
+
+    def transfer(self, source, destination, amount):
+        with self.card_locks.hold(source, destination):
+            # a cached balance may be up to one TTL old, so check funds against the database
+            account_properties = self.database.find_account(source)
+            if account_properties is None or account_properties[2] < amount:
+                return False
+
+            transferred = self.database.transfer(source, destination, amount)
+            self.cache.invalidate(source, destination)
+            return transferred
 
     def close_account(self, account):
-        self.database.close_account(account.card_id)
+        with self.card_locks.hold(account.card_id):
+            self.database.close_account(account.card_id)
+            if self._card_index is not None:
+                self._card_index.remove(account.card_id)
+            self.cache.invalidate(account.card_id)
+
+    def load_table(self, batch_size=10000):
+        return AccountTable.from_rows(self.database.iter_accounts(batch_size))
 
     def check_account(self, card_id):
+        # the index only knows cards this process has seen, so only SQLite can answer this
         return self.database.check_account(card_id)
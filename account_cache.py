@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class AccountCache:
+    def __init__(self, capacity=10000, ttl=30.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.accounts = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.expirations = 0
+
+    def get(self, card_id):
+        with self.lock:
+            entry = self.accounts.get(card_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            account, expires = entry
+            # other processes can close or change the card without invalidating this cache
+            if expires <= time.monotonic():
+                del self.accounts[card_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.accounts.move_to_end(card_id)
+            return account
+
+    def put(self, account, generation):
+        with self.lock:
+            # an invalidation since the caller started reading means the row may be stale
+            if generation != self.generation:
+                return
+
+            self.accounts[account.card_id] = (account, time.monotonic() + self.ttl)
+            self.accounts.move_to_end(account.card_id)
+            if len(self.accounts) > self.capacity:
+                self.accounts.popitem(last=False)
+
+    def invalidate(self, *card_ids):
+        with self.lock:
+            self.generation += 1
+            for card_id in card_ids:
+                if self.accounts.pop(card_id, None) is not None:
+                    self.invalidations += 1
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.accounts),
+                    'capacity': self.capacity,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'invalidations': self.invalidations,
+                    'expirations': self.expirations}
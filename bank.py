@@ -1,26 +1,40 @@
-from utils import singleton
+from inspect import isgenerator
+
 from account import AccountSupervisor
+from console import Console
 from luhn import Luhn
 
 
-@singleton
+def run_steps(steps, read):
+    # a handler yields once per line of input it needs; answer each yield with read()
+    try:
+        steps.send(None)
+        while True:
+            steps.send(read())
+    except StopIteration as stop:
+        return stop.value
+
+
 class BankSystem:
-    def __init__(self, database):
+    def __init__(self, database, console=None, **supervisor_options):
+        self.console = console or Console()
         self.login_state = LogInState(self)
         self.logout_state = LogOutState(self)
         self.state = self.logout_state
 
         self.account = None
-        self.supervisor = AccountSupervisor(database)
+        self.supervisor = AccountSupervisor(database, **supervisor_options)
 
     def show(self):
         self.state.show()
 
     def main_loop(self):
+        return run_steps(self.session(), self.console.read)
+
+    def session(self):
         while True:
             self.show()
-            user_input = input()
-            response = self.state.handle_input(user_input)
+            response = yield from self.state.steps((yield))
             if response == 'exit':
                 return
 
@@ -41,16 +55,19 @@ class BankSystem:
 
     def get_balance(self):
         if self.account:
-            return self.account.balance
+            return self.supervisor.get_balance(self.account.card_id)
 
     def get_accounts(self):
         return self.supervisor.database.get_accounts()
 
+    def iter_accounts(self, batch_size=1000, after_id=0):
+        return self.supervisor.database.iter_accounts(batch_size, after_id)
+
 
-@singleton
 class LogOutState:
     def __init__(self, system):
         self.system = system
+        self.console = system.console
 
         self.methods = {
             '1': self._create_account,
@@ -58,58 +75,77 @@ class LogOutState:
             '0': self._exit_app
         }
 
-    @staticmethod
-    def show():
-        print('1. Create an account')
-        print('2. Log into account')
-        print('0. Exit')
+    def show(self):
+        self.console.write('1. Create an account')
+        self.console.write('2. Log into account')
+        self.console.write('0. Exit')
 
     def handle_input(self, user_input):
+        return run_steps(self.steps(user_input), self.console.read)
+
+    def steps(self, user_input):
         if user_input not in self.methods.keys():
             raise KeyError
 
-        return self.methods[user_input]()
+        response = self.methods[user_input]()
+        if isgenerator(response):
+            response = yield from response
+        return response
+
+    def create_account(self):
+        return self.system.supervisor.add_account()
+
+    def log_into(self, card_id, pin):
+        account = self.system.supervisor.get_account(card_id, pin)
+        if not account:
+            return False
+
+        self.system.set_state('login')
+        self.system.set_account(account)
+        return True
 
     def _create_account(self):
-        account = self.system.supervisor.add_account()
-        print(('\nYour card has been created\n'
-               'Your card number:\n'
-               f'{account.card_id}\n'
-               'Your card PIN:\n'
-               f'{account.pin}\n'))
+        account = self.create_account()
+        self.console.write(('\nYour card has been created\n'
+                            'Your card number:\n'
+                            f'{account.card_id}\n'
+                            'Your card PIN:\n'
+                            f'{account.pin}\n'))
 
-    def _get_account(self):
-        print('\nEnter your card number:')
-        card_id = input()
+    def _get_credentials(self):
+        self.console.write('\nEnter your card number:')
+        card_id = yield
 
-        print('Enter your PIN:')
-        pin = input()
+        self.console.write('Enter your PIN:')
+        pin = yield
 
-        return self.system.supervisor.get_account(card_id, pin)
+        return card_id, pin
 
     def _log_into(self):
-        account = self._get_account()
-        if not account:
-            print('\nWrong card number or PIN!\n')
+        if not self.log_into(*(yield from self._get_credentials())):
+            self.console.write('\nWrong card number or PIN!\n')
             return
 
-        self.system.set_state('login')
-        self.system.set_account(account)
-        print('\nYou have successfully logged in!\n')
+        self.console.write('\nYou have successfully logged in!\n')
 
-    @staticmethod
-    def _exit_app():
-        print('\nBye!')
+    def _exit_app(self):
+        self.console.write('\nBye!')
         return 'exit'
 
     def __str__(self):
         return 'LogOut'
 
 
-@singleton
 class LogInState:
+    CARD_ERRORS = {
+        'same_account': "You can't transfer money to the same account!\n",
+        'invalid_card': 'Probably you made a mistake in the card number. Please try again!\n',
+        'unknown_card': 'Such a card does not exist.\n',
+    }
+
     def __init__(self, system):
         self.system = system
+        self.console = system.console
 
         self.methods = {
             '1': self._show_balance,
@@ -120,87 +156,100 @@ class LogInState:
             '0': self._exit_app
         }
 
-    @staticmethod
-    def show():
-        print('1. Balance')
-        print('2. Add income')
-        print('3. Do transfer')
-        print('4. Close account')
-        print('5. Log out')
-        print('0. Exit')
+    def show(self):
+        self.console.write('1. Balance')
+        self.console.write('2. Add income')
+        self.console.write('3. Do transfer')
+        self.console.write('4. Close account')
+        self.console.write('5. Log out')
+        self.console.write('0. Exit')
 
     def handle_input(self, user_input):
+        return run_steps(self.steps(user_input), self.console.read)
+
+    def steps(self, user_input):
         if user_input not in self.methods.keys():
             raise KeyError
 
-        return self.methods[user_input]()
+        response = self.methods[user_input]()
+        if isgenerator(response):
+            response = yield from response
+        return response
+
+    def add_income(self, income):
+        return self.system.supervisor.add_income(self.system.get_card_id(), income)
+
+    def transfer(self, card_id, income):
+        error = self._check_card_id(card_id)
+        if error:
+            return error
+
+        if not self._transfer_money_if_possible(card_id, income):
+            return 'insufficient_funds'
+
+    def close_account(self):
+        self.system.supervisor.close_account(self.system.get_account())
+        self.log_out()
+
+    def log_out(self):
+        self.system.set_account(None)
+        self.system.set_state('logout')
 
     def _show_balance(self):
-        print(f'\nBalance: {self.system.get_balance()}\n')
+        self.console.write(f'\nBalance: {self.system.get_balance()}\n')
 
     def _add_income(self):
-        print('\nEnter income:')
-        income = int(input())
+        self.console.write('\nEnter income:')
+        income = int((yield))
 
-        self.system.account.balance += income
-        self.system.supervisor.add_income(self.system.get_card_id(), income)
-        print('Income was added!\n')
+        if not self.add_income(income):
+            # another session or process closed the card while this one was logged in
+            self.log_out()
+            self.console.write('\nThe account no longer exists!\n')
+            return
+
+        self.console.write('Income was added!\n')
 
     def _do_transfer(self):
-        print('\nTransfer')
+        self.console.write('\nTransfer')
 
-        print('Enter card number:')
-        card_id = input()
-        if not self._check_card_id(card_id):
+        self.console.write('Enter card number:')
+        card_id = yield
+        error = self._check_card_id(card_id)
+        if error:
+            self.console.write(self.CARD_ERRORS[error])
             return
 
-        print('Enter how much money you want to transfer:')
-        income = int(input())
+        self.console.write('Enter how much money you want to transfer:')
+        income = int((yield))
         if self._transfer_money_if_possible(card_id, income):
-            print('Success!\n')
+            self.console.write('Success!\n')
         else:
-            print('Not enough money!\n')
+            self.console.write('Not enough money!\n')
 
     def _check_card_id(self, card_id):
         if card_id == self.system.get_account().card_id:
-            print("You can't transfer money to the same account!\n")
-            return False
+            return 'same_account'
 
         if not Luhn.check(card_id):
-            print('Probably you made a mistake in the card number. Please try again!\n')
-            return False
+            return 'invalid_card'
 
         if not self.system.supervisor.check_account(card_id):
-            print('Such a card does not exist.\n')
-            return False
-
-        return True
+            return 'unknown_card'
 
     def _transfer_money_if_possible(self, card_id, income):
-        if income > self.system.get_balance():
-            return False
-
-        self.system.account.balance -= income
-        self.system.supervisor.add_income(self.system.get_card_id(), -income)
-        self.system.supervisor.add_income(card_id, income)
-        return True
+        return self.system.supervisor.transfer(self.system.get_card_id(), card_id, income)
 
     def _close_account(self):
-        self.system.supervisor.close_account(self.system.get_account())
-        self.system.set_account(None)
-        print('\nThe account has been closed!\n')
-
-        self.system.set_state('logout')
+        self.close_account()
+        self.console.write('\nThe account has been closed!\n')
 
     def _log_out(self):
-        self.system.set_account(None)
-
-        self.system.set_state('logout')
-        print('\nYou have successfully logged out!\n')
+        self.log_out()
+        self.console.write('\nYou have successfully logged out!\n')
 
-    @staticmethod
-    def _exit_app():
-        print('\nBye!')
+    def _exit_app(self):
+        self.console.write('\nBye!')
         return 'exit'
 
     def __str__(self):
@@ -0,0 +1,91 @@
+import json
+from sqlite3 import Error
+
+
+class BatchDriver:
+    LOGIN_REQUIRED = ('balance', 'income', 'transfer', 'close', 'logout')
+
+    def __init__(self, system):
+        self.system = system
+        self.operations = {
+            'create': self._create,
+            'login': self._login,
+            'balance': self._balance,
+            'income': self._income,
+            'transfer': self._transfer,
+            'close': self._close,
+            'logout': self._logout,
+        }
+
+    def execute(self, operation):
+        name = operation.get('op')
+        result = {'op': name}
+        if 'id' in operation:
+            result['id'] = operation['id']
+
+        if not isinstance(name, str) or name not in self.operations:
+            return {**result, 'ok': False, 'error': 'unknown_operation'}
+
+        logged_in = self.system.get_state() is self.system.login_state
+        if name in self.LOGIN_REQUIRED and not logged_in:
+            return {**result, 'ok': False, 'error': 'not_logged_in'}
+        if name == 'login' and logged_in:
+            return {**result, 'ok': False, 'error': 'already_logged_in'}
+
+        try:
+            error, data = self.operations[name](operation)
+        except (KeyError, TypeError, ValueError):
+            return {**result, 'ok': False, 'error': 'bad_request'}
+        except Error:
+            return {**result, 'ok': False, 'error': 'database_error'}
+
+        if error:
+            return {**result, 'ok': False, 'error': error}
+        return {**result, 'ok': True, **data}
+
+    def run(self, lines, output):
+        executed = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                operation = json.loads(line)
+            except ValueError:
+                operation = None
+
+            if isinstance(operation, dict):
+                result = self.execute(operation)
+            else:
+                result = {'op': None, 'ok': False, 'error': 'bad_json'}
+            output.write(json.dumps(result) + '\n')
+            executed += 1
+        return executed
+
+    def _create(self, operation):
+        account = self.system.logout_state.create_account()
+        return None, {'card': account.card_id, 'pin': account.pin}
+
+    def _login(self, operation):
+        if not self.system.logout_state.log_into(str(operation['card']), str(operation['pin'])):
+            return 'wrong_credentials', None
+        return None, {'card': self.system.get_card_id()}
+
+    def _balance(self, operation):
+        return None, {'balance': self.system.get_balance()}
+
+    def _income(self, operation):
+        if not self.system.login_state.add_income(int(operation['amount'])):
+            return 'unknown_card', None
+        return None, {}
+
+    def _transfer(self, operation):
+        return self.system.login_state.transfer(str(operation['card']),
+                                                int(operation['amount'])), {}
+
+    def _close(self, operation):
+        self.system.login_state.close_account()
+        return None, {}
+
+    def _logout(self, operation):
+        self.system.login_state.log_out()
+        return None, {}
@@ -0,0 +1,105 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+from itertools import zip_longest
+
+from account import AccountSupervisor
+from database import Database
+from sharding import ShardedDatabase
+
+
+def worker(supervisor, source, destination, transfers, barrier):
+    barrier.wait()
+    for _ in range(transfers):
+        supervisor.transfer(source, destination, 1)
+
+
+def measure(supervisor, pairs, transfers):
+    barrier = threading.Barrier(len(pairs) + 1)
+    threads = [threading.Thread(target=worker,
+                                args=(supervisor, source, destination, transfers, barrier))
+               for source, destination in pairs]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return len(pairs) * transfers / (time.perf_counter() - start)
+
+
+def disjoint_pairs(supervisor, count, funds, shard_of):
+    # pair cards that live on the same shard so no transfer crosses shards, then deal the
+    # pairs round-robin so concurrent threads land on different files
+    shards = {}
+    while True:
+        for account in supervisor.add_accounts(2 * count):
+            shards.setdefault(shard_of(account.card_id), []).append(account.card_id)
+        rounds = zip_longest(*(zip(cards[::2], cards[1::2]) for cards in shards.values()))
+        pairs = [pair for pairs in rounds for pair in pairs if pair]
+        if len(pairs) >= count:
+            break
+
+    pairs = pairs[:count]
+    for source, _ in pairs:
+        supervisor.add_income(source, funds)
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Report transfers/sec against thread count for transfers on disjoint cards.')
+    parser.add_argument('-t', '--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('-n', '--transfers', type=int, default=500,
+                        help='transfers per thread')
+    parser.add_argument('--stripes', type=int, default=1024,
+                        help='lock stripes; compared against a single global lock')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='also run the striped locks over N sharded files, so disjoint '
+                             'cards do not share one SQLite writer')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs per configuration; the best rate is reported')
+    parser.add_argument('--durability', default='balanced',
+                        choices=Database.DURABILITY_PROFILES)
+    args = parser.parse_args()
+
+    threads = max(args.threads)
+    funds = args.transfers * args.repeat * 10
+    options = {'durability': args.durability, 'pool_size': threads}
+    with tempfile.TemporaryDirectory() as directory:
+        database = Database(os.path.join(directory, 'card.s3db'), **options)
+        striped = AccountSupervisor(database, pin_cost=1000, lock_stripes=args.stripes)
+        pairs = disjoint_pairs(striped, threads, funds, lambda number: database)
+        configurations = {'global': (AccountSupervisor(database, pin_cost=1000, lock_stripes=1),
+                                     pairs),
+                          'striped': (striped, pairs)}
+
+        if args.shards:
+            sharded = ShardedDatabase.in_directory(directory, args.shards, **options)
+            supervisor = AccountSupervisor(sharded, pin_cost=1000, lock_stripes=args.stripes)
+            configurations['sharded'] = (
+                supervisor, disjoint_pairs(supervisor, threads, funds, sharded.shard_for))
+
+        print(f'{"threads":>7} ' + ' '.join(f'{name + "/sec":>12}' for name in configurations)
+              + ' ' + ' '.join(f'{name + " x":>10}' for name in configurations if name != 'global'))
+        for count in args.threads:
+            rates = {name: 0.0 for name in configurations}
+            for _ in range(args.repeat):
+                # interleave the runs so no configuration always benefits from a warmer cache
+                for name, (supervisor, pairs) in configurations.items():
+                    rates[name] = max(rates[name],
+                                      measure(supervisor, pairs[:count], args.transfers))
+            print(f'{count:>7} ' + ' '.join(f'{rate:12.1f}' for rate in rates.values()) + ' '
+                  + ' '.join(f'{rate / rates["global"]:10.2f}'
+                             for name, rate in rates.items() if name != 'global'))
+
+        for name, (supervisor, _) in configurations.items():
+            if name != 'global':
+                print(f'{name} locks: {supervisor.card_locks.get_stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bank import BankSystem
+from console import ScriptConsole
+from database import Database
+
+PROVISION_CHUNK = 100000
+SAMPLE_SIZE = 1000
+
+
+def provision(supervisor, accounts):
+    sample = []
+    remaining = accounts
+    while remaining:
+        created = supervisor.add_accounts(min(remaining, PROVISION_CHUNK))
+        sample.extend(created[:SAMPLE_SIZE - len(sample)])
+        remaining -= len(created)
+    return sample
+
+
+def run(bank, inputs):
+    bank.console.feed(inputs[1:])
+    start = time.perf_counter()
+    bank.state.handle_input(inputs[0])
+    return time.perf_counter() - start
+
+
+def log_in(bank, account):
+    run(bank, ['2', account.card_id, account.pin])
+
+
+def log_out(bank):
+    run(bank, ['5'])
+
+
+def create_flow(bank, sample):
+    return run(bank, ['1'])
+
+
+def login_flow(bank, sample):
+    account = random.choice(sample)
+    elapsed = run(bank, ['2', account.card_id, account.pin])
+    log_out(bank)
+    return elapsed
+
+
+def income_flow(bank, sample):
+    log_in(bank, sample[0])
+    elapsed = run(bank, ['2', '10'])
+    log_out(bank)
+    return elapsed
+
+
+def transfer_flow(bank, sample):
+    log_in(bank, sample[0])
+    elapsed = run(bank, ['3', random.choice(sample[1:]).card_id, '1'])
+    log_out(bank)
+    return elapsed
+
+
+def close_flow(bank, sample):
+    account = bank.supervisor.add_account()
+    log_in(bank, account)
+    return run(bank, ['4'])
+
+
+FLOWS = {
+    'create': create_flow,
+    'login': login_flow,
+    'income': income_flow,
+    'transfer': transfer_flow,
+    'close': close_flow,
+}
+
+
+def percentile(samples, fraction):
+    return samples[int(fraction * (len(samples) - 1))]
+
+
+def report(accounts, flow, samples):
+    samples.sort()
+    total = sum(samples)
+    print(f'{accounts:>10} {flow:>9} '
+          f'{percentile(samples, 0.5) * 1000:9.3f} '
+          f'{percentile(samples, 0.99) * 1000:9.3f} '
+          f'{len(samples) / total:12.1f}')
+
+
+def benchmark(directory, accounts, operations, flows, durability, pin_cost):
+    database = Database(os.path.join(directory, f'card_{accounts}.s3db'),
+                        durability=durability)
+    bank = BankSystem(database, ScriptConsole(), pin_cost=pin_cost)
+
+    sample = provision(bank.supervisor, max(accounts, 2))
+    bank.supervisor.add_income(sample[0].card_id, operations * 10)
+
+    for flow in flows:
+        samples = [FLOWS[flow](bank, sample) for _ in range(operations)]
+        report(accounts, flow, samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Drive the bank menu flows and report latency and throughput.')
+    parser.add_argument('-a', '--accounts', type=int, nargs='+', default=[1000, 100000],
+                        help='table sizes to benchmark, e.g. 1000 100000 10000000')
+    parser.add_argument('-n', '--operations', type=int, default=1000,
+                        help='operations per flow')
+    parser.add_argument('-f', '--flows', nargs='+', default=list(FLOWS), choices=FLOWS)
+    parser.add_argument('--durability', default='strict',
+                        choices=Database.DURABILITY_PROFILES)
+    parser.add_argument('--pin-cost', type=int, default=1000,
+                        help='PBKDF2 iterations per PIN hash; low by default to keep provisioning fast')
+    args = parser.parse_args()
+
+    print(f'{"accounts":>10} {"flow":>9} {"p50 ms":>9} {"p99 ms":>9} {"ops/sec":>12}')
+    with tempfile.TemporaryDirectory() as directory:
+        for accounts in args.accounts:
+            benchmark(directory, accounts, args.operations, args.flows, args.durability,
+                      args.pin_cost)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import argparse
+import time
+
+from pins import PinHasher
+
+
+def measure(hasher, pin, stored, logins):
+    start = time.perf_counter()
+    for _ in range(logins):
+        hasher.verified.clear()
+        hasher.verify(pin, stored)
+    cold = (time.perf_counter() - start) / logins
+
+    start = time.perf_counter()
+    for _ in range(logins):
+        hasher.verify(pin, stored)
+    cached = (time.perf_counter() - start) / logins
+    return cold, cached
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure PIN verification latency for a range of hashing costs.')
+    parser.add_argument('-c', '--costs', type=int, nargs='+',
+                        default=[1000, 5000, 10000, 50000, 100000])
+    parser.add_argument('-n', '--logins', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=5.0,
+                        help='per-login latency budget in milliseconds')
+    args = parser.parse_args()
+
+    print(f'{"cost":>8} {"verify ms":>10} {"cached ms":>10} {"logins/sec":>11}  budget')
+    for cost in args.costs:
+        hasher = PinHasher(cost)
+        cold, cached = measure(hasher, '0123', hasher.hash('0123'), args.logins)
+        within = 'ok' if cold * 1000 <= args.budget else 'over'
+        print(f'{cost:>8} {cold * 1000:10.3f} {cached * 1000:10.4f} {1 / cold:11.1f}  {within}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import os
+import tempfile
+import time
+
+from account import AccountSupervisor
+from database import Database
+
+
+def two_commit_transfer(supervisor, source, destination, amount):
+    supervisor.add_income(source, -amount)
+    supervisor.add_income(destination, amount)
+
+
+def single_commit_transfer(supervisor, source, destination, amount):
+    supervisor.transfer(source, destination, amount)
+
+
+def measure(transfer, supervisor, source, destination, transfers):
+    start = time.perf_counter()
+    for _ in range(transfers):
+        transfer(supervisor, source, destination, 1)
+    return transfers / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare transfers/sec of two-commit and single-commit transfers.')
+    parser.add_argument('-n', '--transfers', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        supervisor = AccountSupervisor(Database(os.path.join(directory, 'card.s3db')))
+        source, destination = supervisor.add_accounts(2)
+        supervisor.add_income(source.card_id, args.transfers * 2)
+
+        for name, transfer in (('two-commit', two_commit_transfer),
+                               ('single-commit', single_commit_transfer)):
+            rate = measure(transfer, supervisor, source.card_id,
+                           destination.card_id, args.transfers)
+            print(f'{name:>14}: {rate:10.1f} transfers/sec')
+
+
+if __name__ == '__main__':
+    main()
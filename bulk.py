@@ -0,0 +1,136 @@
+import argparse
+import csv
+import json
+import os
+from itertools import islice
+
+from account import BANK_IDENTIFICATION_NUMBER
+from database import Database
+from luhn import Luhn
+from pins import PinHasher
+
+FIELDS = ('number', 'pin', 'balance')
+CARD_NUMBER_LENGTH = 16
+PIN_LENGTH = 4
+
+
+def detect_format(path):
+    return 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.json') else 'csv'
+
+
+def parse_record(record):
+    number, pin = record['number'], record['pin']
+    if number is None or pin is None:
+        raise ValueError('missing number or pin')
+    return str(number), str(pin), int(record.get('balance') or 0)
+
+
+def read_rows(file, fmt):
+    if fmt == 'csv':
+        records = csv.DictReader(file)
+    else:
+        records = (line for line in file if line.strip())
+
+    for record in records:
+        try:
+            yield parse_record(record if fmt == 'csv' else json.loads(record))
+        except (KeyError, TypeError, ValueError):
+            # a malformed row is rejected on its own instead of aborting the import
+            yield None
+
+
+def is_bank_card(number):
+    return len(number) == CARD_NUMBER_LENGTH and number.startswith(BANK_IDENTIFICATION_NUMBER)
+
+
+def chunked(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Importer:
+    def __init__(self, database, chunk_size=50000, pin_cost=10000, workers=None):
+        self.database = database
+        self.chunk_size = chunk_size
+        self.pin_hasher = PinHasher(pin_cost)
+        self.workers = workers
+        self.read = 0
+        self.rejected = 0
+        self.imported = 0
+
+    def _validated(self, rows):
+        for chunk in chunked(rows, self.chunk_size):
+            candidates = [row for row in chunk if row is not None and is_bank_card(row[0])]
+            valid = Luhn.check_many([number for number, _, _ in candidates])
+            accepted = [row for row, ok in zip(candidates, valid) if ok]
+            self.read += len(chunk)
+            self.rejected += len(chunk) - len(accepted)
+            yield self._hashed(accepted)
+
+    def _hashed(self, rows):
+        # plain text PINs from older exports must not be stored at rest; numeric exports
+        # dropped leading zeros, which verify() used to forgive on the plain text
+        legacy = [i for i, (_, pin, _) in enumerate(rows) if self.pin_hasher.is_legacy(pin)]
+        pin_hashes = self.pin_hasher.hash_many([rows[i][1].zfill(PIN_LENGTH) for i in legacy],
+                                               self.workers)
+        for i, pin_hash in zip(legacy, pin_hashes):
+            number, _, balance = rows[i]
+            rows[i] = number, pin_hash, balance
+        return rows
+
+    def run(self, path, fmt=None):
+        with open(path, newline='') as file:
+            rows = read_rows(file, fmt or detect_format(path))
+            self.imported = self.database.import_accounts(self._validated(rows))
+        return {'read': self.read,
+                'imported': self.imported,
+                'rejected': self.rejected,
+                'duplicates': self.read - self.rejected - self.imported}
+
+
+def export_accounts(database, path, fmt=None, batch_size=10000):
+    exported = 0
+    with open(path, 'w', newline='') as file:
+        if (fmt or detect_format(path)) == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(FIELDS)
+            write = writer.writerow
+        else:
+            def write(row):
+                file.write(json.dumps(dict(zip(FIELDS, row))) + '\n')
+
+        for _, number, pin, balance in database.iter_accounts(batch_size):
+            write((number, pin, balance))
+            exported += 1
+    return {'exported': exported}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import or export the card table as CSV or JSONL.')
+    parser.add_argument('command', choices=('import', 'export'))
+    parser.add_argument('path')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='file format, guessed from the extension by default')
+    parser.add_argument('--database', default='card.s3db')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--pin-cost', type=int, default=10000,
+                        help='PBKDF2 iterations for plain text PINs found in the import')
+    parser.add_argument('--workers', type=int,
+                        help='hash PINs in N worker processes')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        database = Database(args.database, durability='fast')
+        result = Importer(database, args.chunk_size, args.pin_cost,
+                          args.workers).run(args.path, args.format)
+    else:
+        database = Database(args.database, replica=True)
+        result = export_accounts(database, args.path, args.format, args.chunk_size)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
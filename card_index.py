@@ -0,0 +1,94 @@
+import math
+import threading
+from array import array
+from bisect import bisect_left
+
+
+class BloomFilter:
+    MASK = (1 << 64) - 1
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1024)
+        self.error_rate = error_rate
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        first = (key * 0x9E3779B97F4A7C15) & self.MASK
+        second = ((key ^ (key >> 31)) * 0xBF58476D1CE4E5B9 & self.MASK) | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        self.add_many((key,))
+
+    def add_many(self, keys):
+        bits, size, hashes, mask = self.bits, self.size, self.hashes, self.MASK
+        for key in keys:
+            first = (key * 0x9E3779B97F4A7C15) & mask
+            second = ((key ^ (key >> 31)) * 0xBF58476D1CE4E5B9 & mask) | 1
+            for i in range(hashes):
+                position = (first + i * second) % size
+                bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+
+class CardIndex:
+    def __init__(self, numbers=()):
+        self.lock = threading.Lock()
+        self.keys = array('q', sorted({int(number) for number in numbers}))
+        self._rebuild_bloom()
+
+    def _rebuild_bloom(self):
+        self.bloom = BloomFilter(len(self.keys) * 2)
+        self.bloom.add_many(self.keys)
+
+    @staticmethod
+    def _key(number):
+        number = str(number)
+        return int(number) if number.isascii() and number.isdigit() else None
+
+    def _find(self, key):
+        position = bisect_left(self.keys, key)
+        return position if position < len(self.keys) and self.keys[position] == key else None
+
+    def __contains__(self, number):
+        key = self._key(number)
+        if key is None or key not in self.bloom:
+            return False
+
+        with self.lock:
+            return self._find(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, number):
+        self.add_many((number,))
+
+    def add_many(self, numbers):
+        keys = [int(number) for number in numbers]
+        with self.lock:
+            if len(keys) == 1:
+                if self._find(keys[0]) is None:
+                    self.keys.insert(bisect_left(self.keys, keys[0]), keys[0])
+            else:
+                merged = self.keys.tolist()
+                merged.extend(key for key in set(keys) if self._find(key) is None)
+                merged.sort()
+                self.keys = array('q', merged)
+
+            if len(self.keys) > self.bloom.capacity:
+                self._rebuild_bloom()
+            else:
+                self.bloom.add_many(keys)
+
+    def remove(self, number):
+        key = self._key(number)
+        with self.lock:
+            position = self._find(key) if key is not None else None
+            if position is not None:
+                del self.keys[position]
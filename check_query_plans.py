@@ -0,0 +1,37 @@
+import argparse
+import os
+import sys
+import tempfile
+
+from database import Database
+
+
+def check(database):
+    failures = database.find_full_scans()
+    for name in Database.HOT_STATEMENTS:
+        status = 'FULL SCAN' if name in failures else 'ok'
+        print(f'{name:<16} {status:<9} {"; ".join(database.explain(name))}')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fail if any hot query plan scans a whole table.')
+    parser.add_argument('--database', help='check this file instead of a fresh schema')
+    args = parser.parse_args()
+
+    if args.database:
+        failures = check(Database(args.database))
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, 'card.s3db'))
+            failures = check(database)
+            database.close()
+
+    if failures:
+        print(f'{len(failures)} hot queries scan a whole table', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+class Console:
+    @staticmethod
+    def read():
+        return input()
+
+    @staticmethod
+    def write(text=''):
+        print(text)
+
+
+class StreamConsole:
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+
+    async def read(self):
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError
+        return line.decode().rstrip('\r\n')
+
+    def write(self, text=''):
+        self.loop.call_soon_threadsafe(self.writer.write, f'{text}\n'.encode())
+
+
+class ScriptConsole:
+    def __init__(self, inputs=()):
+        self.inputs = list(inputs)
+        self.position = 0
+
+    def feed(self, inputs):
+        self.inputs = list(inputs)
+        self.position = 0
+
+    def read(self):
+        if self.position >= len(self.inputs):
+            raise EOFError
+        self.position += 1
+        return self.inputs[self.position - 1]
+
+    def write(self, text=''):
+        pass
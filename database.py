@@ -1,73 +1,647 @@
+import os
+import queue
 import sqlite3
 import sys
+import threading
+import time
+from contextlib import contextmanager
 from sqlite3 import Error
 
+from metrics import instrumented, metrics
 from utils import singleton
 
 
+class ConnectionPool:
+    WAIT_INTERVAL = 0.05
+
+    def __init__(self, connect, size):
+        self.connect = connect
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.generation = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @contextmanager
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        generation = self.generation
+        conn = self._checkout()
+        self.local.conn = conn
+        try:
+            yield conn
+        finally:
+            self.local.conn = None
+            if generation == self.generation:
+                self.idle.put(conn)
+            else:
+                self._discard(conn)
+
+    def _checkout(self):
+        start = time.perf_counter()
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+                break
+            except queue.Empty:
+                pass
+
+            with self.lock:
+                create = self.created < self.size
+                if create:
+                    self.created += 1
+            if create:
+                conn = self.connect()
+                break
+
+            # connections from before a reset are discarded, so never wait forever
+            try:
+                conn = self.idle.get(timeout=self.WAIT_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        wait = time.perf_counter() - start
+
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return conn
+
+    def get_stats(self):
+        with self.lock:
+            return {'size': self.size,
+                    'created': self.created,
+                    'idle': self.idle.qsize(),
+                    'checkouts': self.checkouts,
+                    'total_wait': self.total_wait,
+                    'mean_wait': self.total_wait / self.checkouts if self.checkouts else 0.0,
+                    'max_wait': self.max_wait}
+
+    def _discard(self, conn):
+        conn.close()
+        with self.lock:
+            self.created -= 1
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def reset(self):
+        self.generation += 1
+        self.close()
+
+
+class GroupCommitter:
+    def __init__(self, database, window, size):
+        # imported here rather than per posting; only group commit needs it
+        from concurrent.futures import Future
+
+        self.new_future = Future
+        self.database = database
+        self.window = window
+        self.size = size
+        self.pending = queue.Queue()
+
+        self.batches = 0
+        self.postings = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, number, income):
+        future = self.new_future()
+        self.pending.put((income, str(number), future))
+        return future
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def _collect(self):
+        first = self.pending.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            try:
+                with metrics.track('Database.group_commit'), \
+                        self.database.transaction() as conn:
+                    credited = [self.database._execute(
+                                    conn, 'add_income', (income, number)).rowcount > 0
+                                for income, number, _ in batch]
+                    self.database._record(
+                        conn, [(number, income, 'income')
+                               for (income, number, _), applied in zip(batch, credited)
+                               if applied])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.postings += len(batch)
+            for (_, _, future), applied in zip(batch, credited):
+                future.set_result(applied)
+
+    def get_stats(self):
+        return {'batches': self.batches,
+                'postings': self.postings,
+                'mean_batch': self.postings / self.batches if self.batches else 0.0}
+
+
 @singleton
+@instrumented('add_account', 'add_accounts', 'import_accounts', 'find_account', 'set_pin',
+              'add_income', 'transfer', 'close_account', 'check_account',
+              'get_accounts_page', 'get_numbers', 'take_snapshot', 'balance_at',
+              'get_ledger', 'refresh_replica', 'adjust_balances')
 class Database:
-    def __init__(self, database_file):
-        self.conn = self._create_connection(database_file)
-        self.cursor = self.conn.cursor()
+    STATEMENT_CACHE_SIZE = 32
+
+    DURABILITY_PROFILES = {
+        'strict': {'journal_mode': 'WAL', 'synchronous': 'FULL',
+                   'cache_size': -2000, 'mmap_size': 0},
+        'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+                     'cache_size': -16000, 'mmap_size': 64 * 1024 ** 2},
+        'fast': {'journal_mode': 'WAL', 'synchronous': 'OFF',
+                 'cache_size': -64000, 'mmap_size': 256 * 1024 ** 2},
+    }
+
+    # statements on the interactive and batch paths that must never scan a whole table
+    HOT_STATEMENTS = ('find_account', 'set_pin', 'add_income', 'withdraw', 'close_account',
+                      'check_account', 'iter_accounts', 'record_imported', 'record_close',
+                      'find_snapshot', 'ledger_tail', 'get_ledger', 'load_run')
+
+    REPLICA_SETTINGS = {'query_only': 'ON', 'cache_size': -64000,
+                        'mmap_size': 1024 ** 3}
+
+    STATEMENTS = {
+        'add_account': """ INSERT INTO card (number, pin, balance)
+                           VALUES (?, ?, ?); """,
+        'import_account': """ INSERT OR IGNORE INTO card (number, pin, balance)
+                              VALUES (?, ?, ?); """,
+        'find_account': """ SELECT number, pin, balance FROM card
+                            WHERE number = ?; """,
+        'set_pin': """ UPDATE card
+                       SET pin = ?
+                       WHERE number = ?; """,
+        'add_income': """ UPDATE card
+                          SET balance = balance + ?
+                          WHERE number = ?; """,
+        'withdraw': """ UPDATE card
+                        SET balance = balance - ?
+                        WHERE number = ? AND balance >= ?; """,
+        'close_account': """ DELETE FROM card
+                             WHERE number = ?; """,
+        'check_account': """ SELECT 1 FROM card
+                             WHERE number = ?; """,
+        'iter_accounts': """ SELECT * FROM card
+                             WHERE id > ?
+                             ORDER BY id
+                             LIMIT ?; """,
+        'get_numbers': """ SELECT number FROM card; """,
+        'get_max_id': """ SELECT COALESCE(MAX(id), 0) FROM card; """,
+        'record': """ INSERT INTO ledger (number, amount, kind, created)
+                      VALUES (?, ?, ?, ?); """,
+        'record_imported': """ INSERT INTO ledger (number, amount, kind, created)
+                               SELECT number, balance, 'import', ? FROM card
+                               WHERE id > ?; """,
+        'record_close': """ INSERT INTO ledger (number, amount, kind, created)
+                            SELECT number, -balance, 'close', ? FROM card
+                            WHERE number = ?; """,
+        'take_full_snapshot': """ INSERT INTO balance_snapshot (number, balance, ledger_id, created)
+                                  SELECT number, balance,
+                                         (SELECT COALESCE(MAX(id), 0) FROM ledger), ?
+                                  FROM card; """,
+        'take_snapshot': """ INSERT INTO balance_snapshot (number, balance, ledger_id, created)
+                             SELECT number, balance,
+                                    (SELECT COALESCE(MAX(id), 0) FROM ledger), ?
+                             FROM card
+                             WHERE number IN (
+                                 SELECT number FROM ledger
+                                 WHERE id > (SELECT COALESCE(MAX(ledger_id), 0) FROM (
+                                                 SELECT ledger_id FROM balance_snapshot
+                                                 ORDER BY id DESC
+                                                 LIMIT 1))); """,
+        'find_snapshot': """ SELECT balance, ledger_id FROM balance_snapshot
+                             WHERE number = ? AND created <= ?
+                             ORDER BY created DESC, id DESC
+                             LIMIT 1; """,
+        'ledger_tail': """ SELECT COUNT(*), COALESCE(SUM(amount), 0) FROM ledger
+                           WHERE number = ? AND id > ? AND created <= ?; """,
+        'load_run': """ SELECT last_id, rows, finished FROM batch_run
+                        WHERE name = ?; """,
+        'save_run': """ INSERT INTO batch_run (name, last_id, rows, finished, updated)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (name) DO UPDATE
+                        SET last_id = excluded.last_id,
+                            rows = batch_run.rows + excluded.rows,
+                            finished = excluded.finished,
+                            updated = excluded.updated; """,
+        'get_ledger': """ SELECT id, number, amount, kind, created FROM ledger
+                          WHERE number = ? AND id > ?
+                          ORDER BY id
+                          LIMIT ?; """,
+    }
+
+    def __init__(self, database_file, durability='strict', pool_size=5,
+                 group_commit_window=None, group_commit_size=100, snapshot_interval=100000,
+                 replica=False, replica_file=None):
+        if durability not in self.DURABILITY_PROFILES:
+            raise ValueError(f'Unknown durability profile: {durability}')
 
-        self._create_accounts_table()
+        self.database_file = database_file
+        self.durability = durability
+        self.pool = ConnectionPool(self._create_connection, pool_size)
+
+        self.replica_file = replica_file
+        self.replica_pool = None
+        if replica or replica_file:
+            self.replica_pool = ConnectionPool(self._create_replica_connection, pool_size)
+        self.statements = dict(self.STATEMENTS)
+        self.statement_stats = {name: [0, 0.0] for name in self.statements}
+        self.stats_lock = threading.Lock()
+        self.schema_ready = False
+
+        self.snapshot_interval = snapshot_interval
+        self.ledger_entries = 0
+        self.snapshot_lock = threading.Lock()
+
+        self.group_committer = None
+        if group_commit_window is not None:
+            self.group_committer = GroupCommitter(
+                self, group_commit_window, group_commit_size)
 
     def __del__(self):
-        self.cursor.close()
-        self.conn.close()
+        self.close()
 
-    @staticmethod
-    def _create_connection(database_file):
+    def close(self):
+        if self.group_committer:
+            self.group_committer.close()
+            self.group_committer = None
+        self.pool.close()
+        if self.replica_pool:
+            self.replica_pool.close()
+
+    def _create_connection(self):
         try:
-            return sqlite3.connect(database_file)
+            conn = sqlite3.connect(self.database_file,
+                                   cached_statements=self.STATEMENT_CACHE_SIZE,
+                                   check_same_thread=False)
         except Error as e:
             print(e)
             sys.exit()
 
-    def _create_accounts_table(self):
+        for pragma, value in self.DURABILITY_PROFILES[self.durability].items():
+            conn.execute(f'PRAGMA {pragma} = {value};')
+
+        if not self.schema_ready:
+            self._create_tables(conn)
+            self.schema_ready = True
+        return conn
+
+    def _create_replica_connection(self):
+        if not self.schema_ready:
+            with self.connection():
+                pass
+        if self.replica_file and not os.path.exists(self.replica_file):
+            self.refresh_replica()
+
+        path = os.path.abspath(self.replica_file or self.database_file)
+        try:
+            conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True,
+                                   cached_statements=self.STATEMENT_CACHE_SIZE,
+                                   check_same_thread=False)
+        except Error as e:
+            print(e)
+            sys.exit()
+
+        for pragma, value in self.REPLICA_SETTINGS.items():
+            conn.execute(f'PRAGMA {pragma} = {value};')
+        return conn
+
+    def connection(self):
+        return self.pool.connection()
+
+    def read_connection(self):
+        return (self.replica_pool or self.pool).connection()
+
+    def live_read_connection(self):
+        # a snapshot replica lags behind; only a same-file replica sees every commit
+        pool = self.pool if self.replica_file else self.replica_pool or self.pool
+        return pool.connection()
+
+    def refresh_replica(self):
+        if not self.replica_file:
+            return
+
+        snapshot_file = f'{self.replica_file}.tmp'
+        snapshot = sqlite3.connect(snapshot_file)
+        try:
+            with self.connection() as conn:
+                conn.backup(snapshot)
+            snapshot.execute('PRAGMA journal_mode = DELETE;')
+        finally:
+            snapshot.close()
+
+        os.replace(snapshot_file, self.replica_file)
+        if self.replica_pool:
+            self.replica_pool.reset()
+
+    @contextmanager
+    def transaction(self):
+        with self.pool.connection() as conn:
+            with conn:
+                yield conn
+            metrics.add_commit()
+
+    def get_profile(self):
+        with self.pool.connection() as conn:
+            settings = {pragma: conn.execute(f'PRAGMA {pragma};').fetchone()[0]
+                        for pragma in self.DURABILITY_PROFILES[self.durability]}
+        return {'durability': self.durability, **settings}
+
+    def get_pool_stats(self):
+        return self.pool.get_stats()
+
+    @classmethod
+    def _create_tables(cls, conn):
         sql_create_table = f""" CREATE TABLE IF NOT EXISTS card (
                                        id INTEGER PRIMARY KEY AUTOINCREMENT,
                                        number TEXT UNIQUE,
                                        pin TEXT,
                                        balance INTEGER DEFAULT 0); """
-        self.cursor.execute(sql_create_table)
-        self.conn.commit()
+        sql_create_ledger = """ CREATE TABLE IF NOT EXISTS ledger (
+                                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                     number TEXT,
+                                     amount INTEGER,
+                                     kind TEXT,
+                                     created REAL); """
+        sql_create_snapshot = """ CREATE TABLE IF NOT EXISTS balance_snapshot (
+                                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                       number TEXT,
+                                       balance INTEGER,
+                                       ledger_id INTEGER,
+                                       created REAL); """
+        sql_create_runs = """ CREATE TABLE IF NOT EXISTS batch_run (
+                                   name TEXT PRIMARY KEY,
+                                   last_id INTEGER,
+                                   rows INTEGER,
+                                   finished INTEGER DEFAULT 0,
+                                   updated REAL); """
+        sql_create_indexes = (
+            """ CREATE INDEX IF NOT EXISTS ledger_number ON ledger (number, id); """,
+            """ CREATE INDEX IF NOT EXISTS balance_snapshot_number
+                   ON balance_snapshot (number, created); """,
+        )
+
+        with conn:
+            conn.execute(sql_create_table)
+            new_ledger = conn.execute(""" SELECT 1 FROM sqlite_master
+                                           WHERE type = 'table' AND name = 'ledger'; """
+                                      ).fetchone() is None
+            conn.execute(sql_create_ledger)
+            conn.execute(sql_create_snapshot)
+            conn.execute(sql_create_runs)
+            for sql in sql_create_indexes:
+                conn.execute(sql)
+
+            # balances that predate the ledger are only known through a snapshot
+            if new_ledger:
+                conn.execute(cls.STATEMENTS['take_full_snapshot'], (time.time(),))
+
+    def _execute(self, conn, name, parameters=(), many=False):
+        execute = conn.executemany if many else conn.execute
+        start = time.perf_counter()
+        cursor = execute(self.statements[name], parameters)
+        elapsed = time.perf_counter() - start
+
+        with self.stats_lock:
+            stats = self.statement_stats[name]
+            stats[0] += 1
+            stats[1] += elapsed
+        metrics.add_rows(cursor.rowcount)
+        return cursor
+
+    def explain(self, name):
+        sql = self.statements[name]
+        with self.connection() as conn:
+            plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', (None,) * sql.count('?'))
+            return [detail for _, _, _, detail in plan]
+
+    def find_full_scans(self, names=None):
+        scans = {}
+        for name in names or self.HOT_STATEMENTS:
+            details = [detail for detail in self.explain(name) if detail.startswith('SCAN')]
+            if details:
+                scans[name] = details
+        return scans
+
+    def register_statements(self, statements):
+        with self.stats_lock:
+            self.statements.update(statements)
+            for name in statements:
+                self.statement_stats.setdefault(name, [0, 0.0])
+
+    def get_statement_stats(self):
+        with self.stats_lock:
+            return {name: {'calls': calls,
+                           'total_time': total_time,
+                           'mean_time': total_time / calls if calls else 0.0}
+                    for name, (calls, total_time) in self.statement_stats.items()}
+
+    def _record(self, conn, entries):
+        now = time.time()
+        rows = [(str(number), amount, kind, now) for number, amount, kind in entries]
+        self._execute(conn, 'record', rows, many=True)
+        self._count_ledger_entries(len(rows))
+
+    def _count_ledger_entries(self, entries):
+        with self.snapshot_lock:
+            self.ledger_entries += entries
+            due = self.ledger_entries >= self.snapshot_interval
+            if due:
+                self.ledger_entries = 0
+        if due:
+            threading.Thread(target=self.take_snapshot, daemon=True).start()
 
     def add_account(self, number, pin, balance):
-        sql_add_account = f""" INSERT INTO card (number, pin, balance)
-                               VALUES ({number}, {pin}, {balance}); """
-        self.cursor.execute(sql_add_account)
-        self.conn.commit()
-
-    def get_account(self, number, pin):
-        sql_get_account = f""" SELECT number, pin, balance FROM card 
-                               WHERE {number} = number AND {pin} = pin """
-        self.cursor.execute(sql_get_account)
-        account_properties = self.cursor.fetchone()
-        return account_properties
+        with self.transaction() as conn:
+            self._execute(conn, 'add_account', (str(number), str(pin), balance))
+            self._record(conn, [(number, balance, 'open')])
+
+    def add_accounts(self, accounts):
+        rows = [(str(number), str(pin), balance)
+                for number, pin, balance in accounts]
+        with self.transaction() as conn:
+            self._execute(conn, 'add_account', rows, many=True)
+            self._record(conn, [(number, balance, 'open') for number, _, balance in rows])
+
+    def import_accounts(self, chunks):
+        with self.connection() as conn:
+            imported = 0
+            for chunk in chunks:
+                rows = [(str(number), str(pin), balance)
+                        for number, pin, balance in chunk]
+                with conn:
+                    # take the write lock before reading the max id so no other insert lands in between
+                    conn.execute('BEGIN IMMEDIATE;')
+                    last_id = self._execute(conn, 'get_max_id').fetchone()[0]
+                    inserted = self._execute(
+                        conn, 'import_account', rows, many=True).rowcount
+                    self._execute(conn, 'record_imported', (time.time(), last_id))
+                metrics.add_commit()
+                self._count_ledger_entries(inserted)
+                imported += inserted
+        return imported
+
+    def find_account(self, number):
+        with self.connection() as conn:
+            account = self._execute(conn, 'find_account', (str(number),)).fetchone()
+        metrics.add_rows(account is not None)
+        return account
+
+    def set_pin(self, number, pin):
+        with self.transaction() as conn:
+            self._execute(conn, 'set_pin', (str(pin), str(number)))
 
     def add_income(self, number, income):
-        sql_add_income = f""" UPDATE card 
-                              SET balance = balance + {income}
-                              WHERE {number} = number """
-        self.cursor.execute(sql_add_income)
-        self.conn.commit()
+        if self.group_committer:
+            return self.group_committer.submit(number, income).result()
+
+        with self.transaction() as conn:
+            credited = self._execute(conn, 'add_income', (income, str(number))).rowcount
+            if credited:
+                self._record(conn, [(number, income, 'income')])
+        return bool(credited)
+
+    def transfer(self, source, destination, amount):
+        if amount <= 0:
+            return False
+
+        with self.transaction() as conn:
+            withdrawn = self._execute(
+                conn, 'withdraw', (amount, str(source), amount)).rowcount
+            if not withdrawn:
+                return False
+            credited = self._execute(conn, 'add_income', (amount, str(destination))).rowcount
+            if not credited:
+                # the destination was closed after it was checked
+                conn.rollback()
+                return False
+            self._record(conn, [(source, -amount, 'transfer_out'),
+                                (destination, amount, 'transfer_in')])
+        return True
 
     def close_account(self, number):
-        sql_close_account = f""" DELETE FROM card 
-                                 WHERE {number} = number """
-        self.cursor.execute(sql_close_account)
-        self.conn.commit()
+        with self.transaction() as conn:
+            self._execute(conn, 'record_close', (time.time(), str(number)))
+            self._execute(conn, 'close_account', (str(number),))
+        self._count_ledger_entries(1)
+
+    def load_run(self, name):
+        with self.connection() as conn:
+            return self._execute(conn, 'load_run', (name,)).fetchone()
+
+    def adjust_balances(self, name, after_id, batch_size, compute, kind):
+        with self.transaction() as conn:
+            # read and update the chunk under one write lock so concurrent postings are not missed
+            conn.execute('BEGIN IMMEDIATE;')
+            accounts = self._execute(conn, 'iter_accounts', (after_id, batch_size)).fetchall()
+            last_id = accounts[-1][0] if accounts else after_id
+            finished = len(accounts) < batch_size
+
+            adjustments = [(number, delta) for number, delta in compute(accounts) if delta]
+            if adjustments:
+                self._execute(conn, 'add_income',
+                              [(delta, number) for number, delta in adjustments], many=True)
+                self._record(conn, [(number, delta, kind) for number, delta in adjustments])
+            self._execute(conn, 'save_run',
+                          (name, last_id, len(accounts), finished, time.time()))
+        return last_id, len(accounts), len(adjustments), finished
+
+    def take_snapshot(self):
+        with self.transaction() as conn:
+            return self._execute(conn, 'take_snapshot', (time.time(),)).rowcount
+
+    def balance_at(self, number, timestamp):
+        with self.read_connection() as conn:
+            snapshot = self._execute(
+                conn, 'find_snapshot', (str(number), timestamp)).fetchone()
+            balance, ledger_id = snapshot or (0, 0)
+            entries, change = self._execute(
+                conn, 'ledger_tail', (str(number), ledger_id, timestamp)).fetchone()
+
+        if not snapshot and not entries:
+            return None
+        return balance + change
+
+    def get_ledger(self, number, after_id=0, limit=1000):
+        with self.read_connection() as conn:
+            return self._execute(
+                conn, 'get_ledger', (str(number), after_id, limit)).fetchall()
 
     def check_account(self, number):
-        sql_check_account = f""" SELECT * FROM card 
-                                 WHERE {number} = number """
-        self.cursor.execute(sql_check_account)
-        return self.cursor.fetchone() != None
+        with self.live_read_connection() as conn:
+            exists = self._execute(
+                conn, 'check_account', (str(number),)).fetchone() is not None
+        metrics.add_rows(exists)
+        return exists
 
-    def get_accounts(self):
-        sql_get_account = f""" SELECT * FROM card """
-        self.cursor.execute(sql_get_account)
-        accounts = self.cursor.fetchall()
+    def get_accounts_page(self, after_id, batch_size):
+        with self.read_connection() as conn:
+            accounts = self._execute(
+                conn, 'iter_accounts', (after_id, batch_size)).fetchall()
+        metrics.add_rows(len(accounts))
         return accounts
+
+    def iter_accounts(self, batch_size=1000, after_id=0):
+        while True:
+            accounts = self.get_accounts_page(after_id, batch_size)
+            yield from accounts
+
+            if len(accounts) < batch_size:
+                return
+            after_id = accounts[-1][0]
+
+    def get_accounts(self):
+        return list(self.iter_accounts())
+
+    def get_numbers(self):
+        with self.live_read_connection() as conn:
+            numbers = {number for number, in self._execute(conn, 'get_numbers')}
+        metrics.add_rows(len(numbers))
+        return numbers
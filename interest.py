@@ -0,0 +1,85 @@
+import argparse
+import json
+import time
+
+from account import AccountTable
+from database import Database
+
+
+def interest(rate):
+    def compute(balances):
+        return [int(balance * rate) if balance > 0 else 0 for balance in balances]
+    return compute
+
+
+def fee(amount, below=None):
+    def compute(balances):
+        return [-min(amount, balance) if balance > 0 and (below is None or balance < below) else 0
+                for balance in balances]
+    return compute
+
+
+class BalanceProcessor:
+    def __init__(self, database, name, rule, kind, chunk_size=50000):
+        self.database = database
+        self.name = name
+        self.rule = rule
+        self.kind = kind
+        self.chunk_size = chunk_size
+
+    def _compute(self, accounts):
+        table = AccountTable.from_rows(accounts)
+        deltas = self.rule(table.balances)
+        return zip((str(card_id) for card_id in table.card_ids), deltas)
+
+    def run(self, progress=None):
+        checkpoint = self.database.load_run(self.name)
+        after_id, done, finished = checkpoint or (0, 0, False)
+
+        rows = adjusted = 0
+        start = time.perf_counter()
+        while not finished:
+            after_id, chunk_rows, chunk_adjusted, finished = self.database.adjust_balances(
+                self.name, after_id, self.chunk_size, self._compute, self.kind)
+            rows += chunk_rows
+            adjusted += chunk_adjusted
+            if progress:
+                progress(after_id, rows)
+        elapsed = time.perf_counter() - start
+
+        return {'run': self.name,
+                'resumed_after_rows': done,
+                'rows': rows,
+                'adjusted': adjusted,
+                'seconds': elapsed,
+                'rows_per_sec': rows / elapsed if elapsed else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Apply interest or fees to every card in resumable chunks.')
+    parser.add_argument('--database', default='card.s3db')
+    parser.add_argument('--run', required=True,
+                        help='run name; an interrupted run resumes, a finished run is skipped')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    rules = parser.add_subparsers(dest='rule', required=True)
+    interest_parser = rules.add_parser('interest')
+    interest_parser.add_argument('--rate', type=float, required=True)
+    fee_parser = rules.add_parser('fee')
+    fee_parser.add_argument('--amount', type=int, required=True)
+    fee_parser.add_argument('--below', type=int,
+                            help='only charge cards whose balance is below this amount')
+    args = parser.parse_args()
+
+    if args.rule == 'interest':
+        rule = interest(args.rate)
+    else:
+        rule = fee(args.amount, args.below)
+
+    database = Database(args.database, durability='balanced')
+    processor = BalanceProcessor(database, args.run, rule, args.rule, args.chunk_size)
+    print(json.dumps(processor.run()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+import threading
+import zlib
+from contextlib import contextmanager
+
+
+class StripedLock:
+    def __init__(self, stripes=1024):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        self.stats_lock = threading.Lock()
+
+        self.acquisitions = 0
+        self.contended = 0
+
+    def stripe_for(self, key):
+        return zlib.crc32(str(key).encode()) % len(self.locks)
+
+    @contextmanager
+    def hold(self, *keys):
+        # always take stripes in ascending order so two transfers in opposite directions cannot deadlock
+        stripes = sorted({self.stripe_for(key) for key in keys})
+        acquired = []
+        contended = 0
+        try:
+            for stripe in stripes:
+                lock = self.locks[stripe]
+                if not lock.acquire(blocking=False):
+                    contended += 1
+                    lock.acquire()
+                acquired.append(lock)
+
+            with self.stats_lock:
+                self.acquisitions += len(acquired)
+                self.contended += contended
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {'stripes': len(self.locks),
+                    'acquisitions': self.acquisitions,
+                    'contended': self.contended}
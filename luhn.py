@@ -1,18 +1,31 @@
 class Luhn:
-    @staticmethod
-    def check(digits):
-        # extract checksum
-        checksum = int(digits[-1])
+    # digit -> digit doubled with 9 subtracted when greater than 9
+    DOUBLED = str.maketrans('0123456789', '0246813579')
+    ZERO = ord('0')
 
-        # multiple odd number by 2
-        digits_list = [int(digit) * 2 if i % 2 == 0 else int(digit)
-                       for i, digit in enumerate(digits[:-1])]
+    @classmethod
+    def _payload_sum(cls, digits):
+        # multiple odd number by 2 and sum all digits as byte values
+        doubled = digits[::2].translate(cls.DOUBLED).encode()
+        kept = digits[1::2].encode()
+        return sum(doubled) + sum(kept) - cls.ZERO * len(digits)
 
-        # subtract 9 from digits greater than 9
-        digits_list = [digit - 9 if digit >
-                       9 else digit for digit in digits_list]
+    @classmethod
+    def check(cls, digits):
+        if not (digits.isascii() and digits.isdigit()):
+            return False
 
-        # merge digits with checksum
-        digits_list += [checksum]
+        return (cls._payload_sum(digits[:-1]) + int(digits[-1])) % 10 == 0
 
-        return True if sum(digits_list) % 10 == 0 else False
+    @classmethod
+    def checksum(cls, digits):
+        return (10 - cls._payload_sum(digits) % 10) % 10
+
+    @classmethod
+    def check_many(cls, numbers):
+        return [cls.check(digits) for digits in numbers]
+
+    @classmethod
+    def checksum_many(cls, numbers):
+        payload_sum = cls._payload_sum
+        return [(10 - payload_sum(digits) % 10) % 10 for digits in numbers]
@@ -1,12 +1,86 @@
-from bank import BankSystem
-from database import Database
+import argparse
+import importlib
+import sys
+import time
+from itertools import islice
 
+MODULES = ('utils', 'metrics', 'luhn', 'card_index', 'account_cache', 'pins',
+           'account', 'console', 'bank', 'database')
+BATCH_MODULES = ('json', 'batch')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simple banking system.')
+    parser.add_argument('--dump', action='store_true',
+                        help='list the stored accounts at startup')
+    parser.add_argument('--dump-limit', type=int, metavar='N',
+                        help='list at most N stored accounts at startup')
+    parser.add_argument('--batch', metavar='PATH',
+                        help="run JSONL operations from PATH ('-' for stdin) instead of the menu")
+    parser.add_argument('--output', metavar='PATH',
+                        help='write batch results to PATH instead of stdout')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='print import and initialization timings to stderr')
+    return parser.parse_args()
+
+
+def timed(timings, label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    timings.append((label, time.perf_counter() - start))
+    return result
 
-if __name__ == '__main__':
-    bank_system = BankSystem(Database('card.s3db'))
 
-    accounts = bank_system.get_accounts()
-    for account in accounts:
+def dump_accounts(bank_system, limit):
+    for account in islice(bank_system.iter_accounts(), limit):
         print(account)
 
-    bank_system.main_loop()
+
+def run_batch(bank_system, driver_class, path, output_path):
+    source = sys.stdin if path == '-' else open(path)
+    output = open(output_path, 'w') if output_path else sys.stdout
+    try:
+        start = time.perf_counter()
+        executed = driver_class(bank_system).run(source, output)
+        elapsed = time.perf_counter() - start
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    rate = executed / elapsed if elapsed else 0.0
+    print(f'{executed} operations in {elapsed:.3f} s ({rate:.1f} ops/sec)', file=sys.stderr)
+
+
+def print_timings(timings):
+    for label, elapsed in timings:
+        print(f'{label:<24} {elapsed * 1000:8.2f} ms', file=sys.stderr)
+    print(f'{"total":<24} {sum(elapsed for _, elapsed in timings) * 1000:8.2f} ms',
+          file=sys.stderr)
+
+
+def main():
+    args = parse_args()
+    timings = []
+
+    names = MODULES + BATCH_MODULES if args.batch else MODULES
+    modules = {name: timed(timings, f'import {name}', importlib.import_module, name)
+               for name in names}
+    database = timed(timings, 'init Database', modules['database'].Database, 'card.s3db')
+    bank_system = timed(timings, 'init BankSystem', modules['bank'].BankSystem, database)
+
+    if args.dump or args.dump_limit is not None:
+        timed(timings, 'dump accounts', dump_accounts, bank_system, args.dump_limit)
+
+    if args.profile_startup:
+        print_timings(timings)
+
+    if args.batch:
+        run_batch(bank_system, modules['batch'].BatchDriver, args.batch, args.output)
+    else:
+        bank_system.main_loop()
+
+
+if __name__ == '__main__':
+    main()
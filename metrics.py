@@ -0,0 +1,153 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, float('inf'))
+
+
+class OperationStats:
+    __slots__ = ('calls', 'errors', 'rows', 'commits', 'latency_sum', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.commits = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def snapshot(self):
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'rows': self.rows,
+                'commits': self.commits,
+                'latency_sum': self.latency_sum,
+                'latency_buckets': dict(zip(map(str, LATENCY_BUCKETS), self.buckets))}
+
+
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.operations = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def _stats(self, name):
+        stats = self.operations.get(name)
+        if stats is None:
+            stats = self.operations.setdefault(name, OperationStats())
+        return stats
+
+    def _current(self):
+        stack = getattr(self.local, 'stack', None)
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def track(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        error = False
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            self.observe(name, elapsed, error)
+
+    def observe(self, name, elapsed, error=False):
+        with self.lock:
+            stats = self._stats(name)
+            stats.calls += 1
+            stats.errors += error
+            stats.latency_sum += elapsed
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    stats.buckets[i] += 1
+                    break
+
+    def add_rows(self, rows):
+        name = self._current() if self.enabled else None
+        if name is not None and rows > 0:
+            with self.lock:
+                self._stats(name).rows += rows
+
+    def add_commit(self):
+        name = self._current() if self.enabled else None
+        if name is not None:
+            with self.lock:
+                self._stats(name).commits += 1
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
+
+    def snapshot(self):
+        with self.lock:
+            return {name: stats.snapshot() for name, stats in sorted(self.operations.items())}
+
+    def to_json(self):
+        import json
+
+        return json.dumps({'timestamp': time.time(), 'operations': self.snapshot()}, indent=2)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for metric, field, kind in (('bank_operation_calls_total', 'calls', 'counter'),
+                                    ('bank_operation_errors_total', 'errors', 'counter'),
+                                    ('bank_operation_rows_total', 'rows', 'counter'),
+                                    ('bank_operation_commits_total', 'commits', 'counter')):
+            lines.append(f'# TYPE {metric} {kind}')
+            lines.extend(f'{metric}{{operation="{name}"}} {stats[field]}'
+                         for name, stats in snapshot.items())
+
+        lines.append('# TYPE bank_operation_latency_seconds histogram')
+        for name, stats in snapshot.items():
+            cumulative = 0
+            for bound, count in stats['latency_buckets'].items():
+                cumulative += count
+                le = '+Inf' if bound == 'inf' else bound
+                lines.append(f'bank_operation_latency_seconds_bucket'
+                             f'{{operation="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'bank_operation_latency_seconds_sum{{operation="{name}"}} '
+                         f'{stats["latency_sum"]}')
+            lines.append(f'bank_operation_latency_seconds_count{{operation="{name}"}} '
+                         f'{stats["calls"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        text = self.to_json() if path.endswith('.json') else self.to_prometheus()
+        with open(path, 'w') as file:
+            file.write(text)
+
+
+metrics = Metrics()
+
+
+def instrumented(*method_names):
+    def decorate(cls):
+        for method_name in method_names:
+            setattr(cls, method_name,
+                    _instrument(getattr(cls, method_name), f'{cls.__name__}.{method_name}'))
+        return cls
+    return decorate
+
+
+def _instrument(method, name):
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return method(*args, **kwargs)
+        with metrics.track(name):
+            return method(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,78 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+
+ALGORITHM = 'pbkdf2_sha256'
+
+
+def _derive(pin, salt, cost):
+    return hashlib.pbkdf2_hmac('sha256', pin.encode(), salt, cost)
+
+
+def hash_pin(pin, cost):
+    salt = os.urandom(16)
+    return f'{ALGORITHM}${cost}${salt.hex()}${_derive(pin, salt, cost).hex()}'
+
+
+class PinHasher:
+    def __init__(self, cost=10000, cache_size=10000):
+        self.cost = cost
+        self.cache_size = cache_size
+        self.verified = OrderedDict()
+        self.secret = os.urandom(32)
+        self.lock = threading.Lock()
+
+        self.cache_hits = 0
+        self.derivations = 0
+
+    def hash(self, pin):
+        return hash_pin(pin, self.cost)
+
+    def hash_many(self, pins, workers=None):
+        if not workers:
+            return [self.hash(pin) for pin in pins]
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(hash_pin, pins, [self.cost] * len(pins),
+                                     chunksize=max(1, len(pins) // (workers * 4))))
+
+    @staticmethod
+    def is_legacy(stored):
+        return not stored.startswith(f'{ALGORITHM}$')
+
+    def verify(self, pin, stored):
+        pin = str(pin)
+        if self.is_legacy(stored):
+            # plain text PINs written before hashing lost their leading zeros
+            stored = stored.encode()
+            return (hmac.compare_digest(stored, pin.encode())
+                    or hmac.compare_digest(stored, (pin.lstrip('0') or '0').encode()))
+
+        key = (stored, hmac.new(self.secret, pin.encode(), 'sha256').digest())
+        with self.lock:
+            if key in self.verified:
+                self.verified.move_to_end(key)
+                self.cache_hits += 1
+                return True
+
+        _, cost, salt, digest = stored.split('$')
+        self.derivations += 1
+        if not hmac.compare_digest(_derive(pin, bytes.fromhex(salt), int(cost)).hex(), digest):
+            return False
+
+        with self.lock:
+            self.verified[key] = True
+            if len(self.verified) > self.cache_size:
+                self.verified.popitem(last=False)
+        return True
+
+    def get_stats(self):
+        with self.lock:
+            return {'cost': self.cost,
+                    'cached': len(self.verified),
+                    'cache_hits': self.cache_hits,
+                    'derivations': self.derivations}
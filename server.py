@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from bank import BankSystem
+from console import StreamConsole
+from database import Database
+from metrics import metrics
+from sharding import ShardedDatabase
+
+
+class BankServer:
+    METRICS_INTERVAL = 15
+
+    def __init__(self, database, max_sessions, metrics_path=None, pin_cost=10000, workers=None):
+        self.database = database
+        self.max_sessions = max_sessions
+        self.pin_cost = pin_cost
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.sessions = 0
+        self.metrics_path = metrics_path
+
+    async def handle_session(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        console = StreamConsole(reader, writer, loop)
+        try:
+            if self.sessions >= self.max_sessions:
+                writer.write(b'Too many sessions, please try again later.\n')
+                await writer.drain()
+                return
+
+            bank_system = BankSystem(self.database, console, pin_cost=self.pin_cost)
+            self.sessions += 1
+            try:
+                await self.run_session(loop, bank_system.session(), console)
+            finally:
+                self.sessions -= 1
+            await writer.drain()
+        except (EOFError, KeyError, ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def run_session(self, loop, session, console):
+        # reads wait on the event loop; only the steps between them, which hit SQLite, use a thread
+        line = None
+        while await loop.run_in_executor(self.executor, self._advance, session, line):
+            line = await console.read()
+
+    @staticmethod
+    def _advance(session, line):
+        try:
+            session.send(line)
+            return True
+        except StopIteration:
+            return False
+
+    async def export_metrics(self):
+        while True:
+            await asyncio.sleep(self.METRICS_INTERVAL)
+            metrics.write(self.metrics_path)
+
+    async def serve(self, host, port, path):
+        if path:
+            server = await asyncio.start_unix_server(self.handle_session, path)
+        else:
+            server = await asyncio.start_server(self.handle_session, host, port)
+
+        if self.metrics_path:
+            metrics.enabled = True
+            exporter = asyncio.create_task(self.export_metrics())
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if self.metrics_path:
+                exporter.cancel()
+                metrics.write(self.metrics_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the bank menu over TCP or a Unix socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of TCP')
+    parser.add_argument('--database', default='card.s3db')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='spread cards over N files named card_<i>.s3db next to --database')
+    parser.add_argument('--durability', default='balanced',
+                        choices=Database.DURABILITY_PROFILES)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--group-commit-window', type=float, metavar='SECONDS',
+                        help='coalesce income postings into one commit per window')
+    parser.add_argument('--max-sessions', type=int, default=1024,
+                        help='turn away connections beyond N open sessions')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='threads running supervisor and SQLite calls for all sessions')
+    parser.add_argument('--pin-cost', type=int, default=10000,
+                        help='PBKDF2 iterations per PIN hash (see benchmarks/pin_cost.py)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='record operation metrics and write them to PATH '
+                             '(JSON for *.json, Prometheus text otherwise)')
+    args = parser.parse_args()
+
+    options = {'durability': args.durability, 'pool_size': args.pool_size,
+               'group_commit_window': args.group_commit_window}
+    if args.shards > 1:
+        directory = os.path.dirname(os.path.abspath(args.database))
+        database = ShardedDatabase.in_directory(directory, args.shards, **options)
+    else:
+        database = Database(args.database, **options)
+    server = BankServer(database, args.max_sessions, args.metrics, args.pin_cost, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
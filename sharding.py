@@ -0,0 +1,203 @@
+import os
+import time
+import uuid
+import zlib
+from itertools import chain
+from sqlite3 import OperationalError
+
+from database import Database
+
+
+class ShardedDatabase:
+    COMMIT_ATTEMPTS = 5
+    RETRY_INTERVAL = 0.05
+
+    SQL_CREATE_LEGS = """ CREATE TABLE IF NOT EXISTS transfer_leg (
+                                 txid TEXT PRIMARY KEY,
+                                 number TEXT,
+                                 amount INTEGER); """
+
+    SQL_CREATE_INTENTS = """ CREATE TABLE IF NOT EXISTS transfer_intent (
+                                    txid TEXT PRIMARY KEY,
+                                    source TEXT,
+                                    destination TEXT,
+                                    amount INTEGER,
+                                    state TEXT DEFAULT 'pending'); """
+
+    STATEMENTS = {
+        'add_intent': """ INSERT INTO transfer_intent (txid, source, destination, amount)
+                          VALUES (?, ?, ?, ?); """,
+        'set_intent_state': """ UPDATE transfer_intent
+                                SET state = ?
+                                WHERE txid = ?; """,
+        'pending_intents': """ SELECT txid, source, destination, amount
+                               FROM transfer_intent
+                               WHERE state = 'pending'; """,
+        'add_leg': """ INSERT INTO transfer_leg (txid, number, amount)
+                       VALUES (?, ?, ?); """,
+        'add_leg_once': """ INSERT OR IGNORE INTO transfer_leg (txid, number, amount)
+                            VALUES (?, ?, ?); """,
+        'find_leg': """ SELECT 1 FROM transfer_leg
+                        WHERE txid = ?; """,
+    }
+
+    def __init__(self, database_files, **options):
+        self.shards = [Database(database_file, **options) for database_file in database_files]
+        self.coordinator = self.shards[0]
+
+        for shard in self.shards:
+            shard.register_statements(self.STATEMENTS)
+            with shard.transaction() as conn:
+                conn.execute(self.SQL_CREATE_LEGS)
+        with self.coordinator.transaction() as conn:
+            conn.execute(self.SQL_CREATE_INTENTS)
+
+        self.recover()
+
+    @classmethod
+    def in_directory(cls, directory, shards, **options):
+        return cls([os.path.join(directory, f'card_{i}.s3db') for i in range(shards)], **options)
+
+    def shard_for(self, number):
+        return self.shards[zlib.crc32(str(number).encode()) % len(self.shards)]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+    def add_account(self, number, pin, balance):
+        self.shard_for(number).add_account(number, pin, balance)
+
+    def _group_by_shard(self, accounts):
+        groups = {}
+        for account in accounts:
+            groups.setdefault(self.shard_for(account[0]), []).append(account)
+        return groups
+
+    def add_accounts(self, accounts):
+        for shard, group in self._group_by_shard(accounts).items():
+            shard.add_accounts(group)
+
+    def import_accounts(self, chunks):
+        imported = 0
+        for chunk in chunks:
+            for shard, group in self._group_by_shard(chunk).items():
+                imported += shard.import_accounts([group])
+        return imported
+
+    def find_account(self, number):
+        return self.shard_for(number).find_account(number)
+
+    def set_pin(self, number, pin):
+        self.shard_for(number).set_pin(number, pin)
+
+    def add_income(self, number, income):
+        return self.shard_for(number).add_income(number, income)
+
+    def close_account(self, number):
+        self.shard_for(number).close_account(number)
+
+    def check_account(self, number):
+        return self.shard_for(number).check_account(number)
+
+    def iter_accounts(self, batch_size=1000, after_id=0):
+        if after_id:
+            raise ValueError('ids are per shard; a sharded scan cannot resume from an id')
+        return chain.from_iterable(shard.iter_accounts(batch_size) for shard in self.shards)
+
+    def get_accounts(self):
+        return list(self.iter_accounts())
+
+    def get_numbers(self):
+        return set().union(*(shard.get_numbers() for shard in self.shards))
+
+    def transfer(self, source, destination, amount):
+        if amount <= 0:
+            return False
+
+        source_shard = self.shard_for(source)
+        destination_shard = self.shard_for(destination)
+        if source_shard is destination_shard:
+            return source_shard.transfer(source, destination, amount)
+
+        txid = uuid.uuid4().hex
+        with self.coordinator.transaction() as conn:
+            self.coordinator._execute(conn, 'add_intent',
+                                      (txid, str(source), str(destination), amount))
+
+        if not self._prepare(source_shard, txid, source, amount):
+            self._set_state(txid, 'aborted')
+            return False
+
+        # the source is already debited, so finish now rather than wait for the next recover()
+        for attempt in range(self.COMMIT_ATTEMPTS):
+            try:
+                return self._finish(txid, source, destination, amount)
+            except OperationalError:
+                if attempt == self.COMMIT_ATTEMPTS - 1:
+                    raise
+                time.sleep(self.RETRY_INTERVAL * 2 ** attempt)
+
+    def _finish(self, txid, source, destination, amount):
+        if self._commit(self.shard_for(destination), txid, destination, amount):
+            self._set_state(txid, 'committed')
+            return True
+
+        self._refund(self.shard_for(source), txid, source, amount)
+        self._set_state(txid, 'refunded')
+        return False
+
+    @staticmethod
+    def _prepare(shard, txid, source, amount):
+        with shard.transaction() as conn:
+            withdrawn = shard._execute(
+                conn, 'withdraw', (amount, str(source), amount)).rowcount
+            if not withdrawn:
+                return False
+            shard._record(conn, [(source, -amount, 'transfer_out')])
+            shard._execute(conn, 'add_leg', (txid, str(source), -amount))
+        return True
+
+    @staticmethod
+    def _commit(shard, txid, destination, amount):
+        with shard.transaction() as conn:
+            applied = shard._execute(
+                conn, 'add_leg_once', (txid, str(destination), amount)).rowcount
+            if not applied:
+                return True
+            credited = shard._execute(conn, 'add_income', (amount, str(destination))).rowcount
+            if not credited:
+                # the destination was closed after it was checked
+                conn.rollback()
+                return False
+            shard._record(conn, [(destination, amount, 'transfer_in')])
+        return True
+
+    @staticmethod
+    def _refund(shard, txid, source, amount):
+        with shard.transaction() as conn:
+            applied = shard._execute(
+                conn, 'add_leg_once', (f'{txid}:refund', str(source), amount)).rowcount
+            if applied:
+                shard._execute(conn, 'add_income', (amount, str(source)))
+                shard._record(conn, [(source, amount, 'transfer_refund')])
+
+    def _set_state(self, txid, state):
+        with self.coordinator.transaction() as conn:
+            self.coordinator._execute(conn, 'set_intent_state', (state, txid))
+
+    @staticmethod
+    def _has_leg(shard, txid):
+        with shard.connection() as conn:
+            return shard._execute(conn, 'find_leg', (txid,)).fetchone() is not None
+
+    def recover(self):
+        with self.coordinator.connection() as conn:
+            pending = self.coordinator._execute(conn, 'pending_intents').fetchall()
+
+        for txid, source, destination, amount in pending:
+            if self._has_leg(self.shard_for(source), txid):
+                self._finish(txid, source, destination, amount)
+            else:
+                self._set_state(txid, 'aborted')
+        return len(pending)
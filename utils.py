@@ -6,7 +6,8 @@ def singleton(cls):
 
     @wraps(cls)
     def get_instance(*args, **kwargs):
-        if cls not in instances:
-            instances[cls] = cls(*args, **kwargs)
-        return instances[cls]
+        key = (args, tuple(sorted(kwargs.items())))
+        if key not in instances:
+            instances[key] = cls(*args, **kwargs)
+        return instances[key]
     return get_instance